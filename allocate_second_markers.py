@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from numba import njit
+from sklearn.feature_extraction.text import HashingVectorizer
 
 
 ###############################################################################
@@ -11,19 +14,25 @@ from sklearn.metrics.pairwise import cosine_similarity
 def load_data():
     print("Loading projects.csv, supervisor_set.csv, capacity.csv...")
 
-    projects = pd.read_csv("projects.csv")
-    supervisor_set = pd.read_csv("supervisor_set.csv")
-    capacity = pd.read_csv("capacity.csv")
+    # pyarrow engine: multithreaded C++ parsing, and arrow-backed columns
+    # so the .str normalisation below runs on arrow kernels too
+    read_opts = {"engine": "pyarrow", "dtype_backend": "pyarrow"}
+
+    projects = pd.read_csv("projects.csv", **read_opts)
+    supervisor_set = pd.read_csv("supervisor_set.csv", **read_opts)
+    capacity = pd.read_csv("capacity.csv", **read_opts)
 
     # Normalise casing
     projects["Username"] = projects["Username"].str.strip().str.lower()
     supervisor_set["username"] = supervisor_set["username"].str.strip().str.lower()
     capacity["Username"] = capacity["Username"].str.strip().str.lower()
 
-    # Compute maximum second-marking load
+    # Compute maximum second-marking load. Cast before filling: an
+    # entirely blank column is inferred as null[pyarrow], whose fillna
+    # raises ArrowInvalid
     capacity["max_second_mark"] = (
-        capacity["Tot.Projects"].fillna(0).astype(float)
-        + capacity["Difference (can be used for extra 2nd marking)"].fillna(0).astype(float)
+        capacity["Tot.Projects"].astype("float64").fillna(0)
+        + capacity["Difference (can be used for extra 2nd marking)"].astype("float64").fillna(0)
     )
 
     return projects, supervisor_set, capacity
@@ -44,6 +53,19 @@ def build_assessor_table(supervisor_set, capacity):
     assessors = assessors.drop(columns=["Username"])
     assessors["max_second_mark"] = assessors["max_second_mark"].fillna(0)
 
+    # Usernames can collapse to duplicates after the strip/lower
+    # normalisation. The allocator indexes assessors by position, so merge
+    # them to one row each here -- otherwise every duplicate row gets its
+    # own capacity pool and the own-project/one-per-primary rules only see
+    # one of the copies. first/last mirror the username-keyed dict
+    # semantics the allocation had before the positional rewrite.
+    assessors = assessors.groupby("username", as_index=False, sort=False).agg(
+        n_projects=("n_projects", "sum"),
+        merged_keywords=("merged_keywords", "first"),
+        merged_types=("merged_types", "first"),
+        max_second_mark=("max_second_mark", "last"),
+    )
+
     return assessors
 
 
@@ -52,109 +74,184 @@ def build_assessor_table(supervisor_set, capacity):
 ###############################################################################
 
 def build_similarity_matrix(projects, assessors):
+    # Arrow-backed strings so the concatenation runs in pyarrow's C++
+    # kernels instead of elementwise Python string addition
     project_text = (
-        projects["keywords_project"].fillna("") + " " +
-        projects["types_project"].fillna("")
+        projects["keywords_project"].astype("string[pyarrow]").fillna("") + " " +
+        projects["types_project"].astype("string[pyarrow]").fillna("")
     )
 
     assessor_text = (
-        assessors["merged_keywords"].fillna("") + " " +
-        assessors["merged_types"].fillna("")
+        assessors["merged_keywords"].astype("string[pyarrow]").fillna("") + " " +
+        assessors["merged_types"].astype("string[pyarrow]").fillna("")
     )
 
     all_text = pd.concat([project_text, assessor_text], ignore_index=True)
 
-    vectorizer = TfidfVectorizer(stop_words="english")
-    tfidf = vectorizer.fit_transform(all_text)
+    # Hashing instead of a fitted vocabulary: single pass over the corpus,
+    # bounded memory, and no vocabulary dict to build — only the cosine
+    # similarity is needed downstream, never the feature names. norm="l2"
+    # means P @ A.T is cosine similarity directly, and float32 is plenty
+    # for an argmax tiebreaker on [0, 1] scores
+    # 2^16 features is ample for keyword/type vocabularies (a few thousand
+    # distinct tokens at most) and keeps the hashed matrices narrow; the
+    # downstream matmul cost is linear in nnz
+    vectorizer = HashingVectorizer(
+        stop_words="english",
+        n_features=1 << 16,
+        alternate_sign=False,
+        norm="l2",
+        dtype=np.float32,
+    )
+    hashed = vectorizer.transform(all_text)
 
-    P = tfidf[:len(project_text)]
-    A = tfidf[len(project_text):]
+    P = hashed[:len(project_text)]
+    A = hashed[len(project_text):]
 
-    return cosine_similarity(P, A)
+    return P, A
 
 
 ###############################################################################
 # ALLOCATE SECOND SUPERVISORS
 ###############################################################################
 
-def allocate_assessors(projects, assessors, similarity):
-    n_projects = len(projects)
+@njit(cache=True)
+def _pick_assessor(sim_row, capacities, max_load, used_row, primary,
+                   fairness_weight, match_weight):
+    """
+    Pick the eligible assessor with the best composite score for one
+    project, or -1 if nobody is eligible. Compiled with numba so the
+    scalar loop runs at machine speed despite the sequential capacity
+    updates between projects.
+    """
+    best_j = -1
+    best_score = -np.inf
+
+    for j in range(sim_row.shape[0]):
+        # Rule 1: cannot mark own project
+        if j == primary:
+            continue
 
-    # Track remaining capacity
-    capacities = dict(zip(
-        assessors["username"],
-        assessors["max_second_mark"]
-    ))
+        # Rule 2: only one project per primary-supervisor
+        if used_row[j]:
+            continue
 
-    # Store initial max capacities for fairness scoring
-    capacities_initial = capacities.copy()
+        # Rule 3: must have remaining capacity (and a non-zero max load)
+        if capacities[j] <= 0 or max_load[j] == 0:
+            continue
 
-    # Prevent: same assessor marking >1 project from same primary supervisor
-    supervisor_pairs = {sup: set() for sup in projects["Username"].unique()}
+        # Fairness: 1 = empty, 0 = full
+        fairness = capacities[j] / max_load[j]
 
-    second_supervisor = []
-    second_keywords = []
-    second_types = []
+        score = fairness_weight * fairness + match_weight * sim_row[j]
 
-    FAIRNESS_WEIGHT = 0.55
-    MATCH_WEIGHT = 0.45
+        if score > best_score:
+            best_j = j
+            best_score = score
 
-    for i in range(n_projects):
-        primary = projects.loc[i, "Username"]
+    return best_j
 
-        candidates = []
 
-        for username, sim_score in zip(assessors["username"], similarity[i]):
+def allocate_assessors(projects, assessors, P, A):
+    n_projects = len(projects)
 
-            # Rule 1: cannot mark own project
-            if username == primary:
-                continue
+    # Position-indexed arrays so the per-project scoring is pure NumPy
+    usernames = assessors["username"].to_numpy()
+    max_load = assessors["max_second_mark"].to_numpy(np.float32)
 
-            # Rule 2: only one project per primary-supervisor
-            if username in supervisor_pairs[primary]:
-                continue
+    # Track remaining capacity (initial max kept in max_load for fairness)
+    capacities = max_load.copy()
 
-            # Rule 3: must have remaining capacity
-            if capacities.get(username, 0) <= 0:
-                continue
+    # Map each project's primary supervisor to an assessor index (-1 = not
+    # an assessor, so nothing to exclude)
+    username_to_idx = {u: j for j, u in enumerate(usernames)}
+    primary_idx = np.array(
+        [username_to_idx.get(p, -1) for p in projects["Username"]]
+    )
 
-            # Compute fairness score
-            max_load = capacities_initial[username]
-            if max_load == 0:
-                continue  # cannot be used at all
+    # Prevent: same assessor marking >1 project from same primary supervisor.
+    # used[p, j] is True once assessor j has taken a project from primary p
+    # (primaries get their own row even when outside the assessor table)
+    primary_to_idx = {u: p for p, u in enumerate(projects["Username"].unique())}
+    primary_row = np.array(
+        [primary_to_idx[u] for u in projects["Username"]]
+    )
+    used = np.zeros((len(primary_to_idx), len(usernames)), dtype=bool)
 
-            current_load = max_load - capacities[username]
-            load_ratio = current_load / max_load
-            fairness_score = 1 - load_ratio  # 1 = empty, 0 = full
+    # Preallocated output columns, filled by position (no list growth)
+    second_supervisor = np.empty(n_projects, dtype=object)
+    second_keywords = np.empty(n_projects, dtype=object)
+    second_types = np.empty(n_projects, dtype=object)
 
-            # Composite score: fairness comes first
-            composite_score = (
-                FAIRNESS_WEIGHT * fairness_score +
-                MATCH_WEIGHT * sim_score
-            )
+    FAIRNESS_WEIGHT = 0.55
+    MATCH_WEIGHT = 0.45
 
-            candidates.append((username, composite_score))
+    # Materialise the whole similarity matrix in one product when it fits
+    # comfortably in memory: a single batched sparse GEMM beats n_projects
+    # separate row products. (The hashed feature matrix itself stays
+    # sparse -- at 2**16 features it is never worth densifying.) Larger
+    # runs fall back to densifying one row at a time.
+    MAX_DENSE_SIMILARITY = 50_000_000  # float32 elements, ~200 MB
 
-        # No eligible candidates
-        if not candidates:
-            second_supervisor.append("UNALLOCATED")
-            second_keywords.append("")
-            second_types.append("")
-            continue
+    similarity = None
+    if n_projects * len(usernames) <= MAX_DENSE_SIMILARITY:
+        similarity = (P @ A.T).toarray()
+
+    # Assessor metadata, fetched once instead of a pandas scan per project
+    # (cast before fillna: an all-empty column is null[pyarrow])
+    assessor_meta = dict(zip(
+        assessors["username"],
+        zip(
+            assessors["merged_keywords"].astype("string[pyarrow]").fillna(""),
+            assessors["merged_types"].astype("string[pyarrow]").fillna("")
+        )
+    ))
 
-        # Pick best composite score
-        candidates.sort(key=lambda x: x[1], reverse=True)
-        chosen = candidates[0][0]
+    # Greedy matching quality depends on iteration order: handle projects
+    # from primaries with few projects first, so they are not starved once
+    # capacities tighten. Results are written back by original position,
+    # so the output row order is unchanged.
+    primary_counts = projects["Username"].map(
+        projects["Username"].value_counts()
+    ).to_numpy()
+    order = np.argsort(primary_counts, kind="stable")
+
+    # Work through the projects a block of rows at a time: one batched
+    # product per block instead of one per project, and the densified
+    # block stays hot in cache while its rows are scored
+    SIM_BLOCK = 64
+
+    for start in range(0, n_projects, SIM_BLOCK):
+        block = order[start:start + SIM_BLOCK]
+
+        if similarity is not None:
+            sims = similarity[block]
+        else:
+            sims = (P[block] @ A.T).toarray()
+
+        for k, i in enumerate(block):
+            chosen_idx = _pick_assessor(
+                sims[k], capacities, max_load,
+                used[primary_row[i]], primary_idx[i],
+                FAIRNESS_WEIGHT, MATCH_WEIGHT
+            )
+
+            # No eligible candidates
+            if chosen_idx < 0:
+                second_supervisor[i] = "UNALLOCATED"
+                second_keywords[i] = ""
+                second_types[i] = ""
+                continue
+
+            chosen = usernames[chosen_idx]
 
-        # Commit allocation
-        second_supervisor.append(chosen)
-        supervisor_pairs[primary].add(chosen)
-        capacities[chosen] -= 1
+            # Commit allocation
+            second_supervisor[i] = chosen
+            used[primary_row[i], chosen_idx] = True
+            capacities[chosen_idx] -= 1
 
-        # Assessor metadata
-        row = assessors.loc[assessors["username"] == chosen].iloc[0]
-        second_keywords.append(row["merged_keywords"])
-        second_types.append(row["merged_types"])
+            # Assessor metadata
+            second_keywords[i], second_types[i] = assessor_meta[chosen]
 
     # Add output columns
     projects["second_supervisor"] = second_supervisor
@@ -177,13 +274,18 @@ def main():
     assessors = build_assessor_table(supervisor_set, capacity)
 
     print("Building similarity matrix...")
-    similarity = build_similarity_matrix(projects, assessors)
+    P, A = build_similarity_matrix(projects, assessors)
 
     print("Allocating assessors...")
-    result = allocate_assessors(projects, assessors, similarity)
+    result = allocate_assessors(projects, assessors, P, A)
 
     print("Saving: projects_with_second_assessors.csv")
-    result.to_csv("projects_with_second_assessors.csv", index=False)
+    # pyarrow's C++ CSV writer; from_pandas without the index matches
+    # the old to_csv(index=False) output
+    pacsv.write_csv(
+        pa.Table.from_pandas(result, preserve_index=False),
+        "projects_with_second_assessors.csv",
+    )
 
     ###########################################################################
     # UPDATE CAPACITY FILE WITH SECOND-MARKING LOAD
@@ -192,15 +294,17 @@ def main():
     print("Updating capacity.csv with second-marking loads...")
 
     # Count how many times each username was assigned
-    load_counts = (
-        result[result["second_supervisor"] != "UNALLOCATED"]
-        .groupby("second_supervisor")
-        .size()
-        .rename("second_marking_load")
-    )
+    load_counts = result.loc[
+        result["second_supervisor"] != "UNALLOCATED", "second_supervisor"
+    ].value_counts()
 
     capacity_updated = capacity.copy()
-    capacity_updated["second_marking_load"] = capacity_updated["Username"].map(load_counts).fillna(0).astype(int)
+    capacity_updated["second_marking_load"] = (
+        load_counts.reindex(capacity_updated["Username"])
+        .fillna(0)
+        .astype(int)
+        .to_numpy()
+    )
 
     # Also add a remaining capacity column
     capacity_updated["remaining_capacity"] = (
@@ -208,7 +312,10 @@ def main():
     )
 
     # Save the updated capacity file
-    capacity_updated.to_csv("capacity_updated.csv", index=False)
+    pacsv.write_csv(
+        pa.Table.from_pandas(capacity_updated, preserve_index=False),
+        "capacity_updated.csv",
+    )
 
     print("Saved updated capacity file as capacity_updated.csv")
 
@@ -1,36 +1,49 @@
 #!/usr/bin/env python3
 import pandas as pd
 
-def merge_unique(values):
+def merge_unique(df, column):
     """
-    Take a Series of comma-separated values and return a single
-    comma-separated string of unique tokens.
+    Collapse the comma-separated values in `column` to one
+    comma-separated string of unique, sorted tokens per supervisor.
+
+    Splitting and deduplication happen frame-wide (split + explode +
+    drop_duplicates) so pandas does the work in C instead of a Python
+    loop over every value in every group.
     """
-    all_vals = []
-    for v in values.dropna():
-        # split on commas and strip whitespace
-        parts = [x.strip() for x in v.split(",") if x.strip()]
-        all_vals.extend(parts)
+    tokens = df[["primary_supervisor"]].copy()
+    # cast first: an all-blank column is read as float64, which has no .str
+    tokens["token"] = df[column].astype("string").str.split(",")
+    tokens = tokens.explode("token")
+
+    # strip whitespace and drop empties (and NaN source values)
+    tokens["token"] = tokens["token"].str.strip()
+    tokens = tokens[tokens["token"].notna() & (tokens["token"] != "")]
 
-    # return unique, sorted for consistency
-    unique_vals = sorted(set(all_vals))
-    return ", ".join(unique_vals)
+    return (
+        tokens.drop_duplicates()
+        .sort_values(["primary_supervisor", "token"])
+        .groupby("primary_supervisor")["token"]
+        .agg(", ".join)
+    )
 
 
 def main():
     print("Loading all_projects.csv...")
     df = pd.read_csv("all_projects.csv")
 
-    # Group by supervisor
-    groups = df.groupby("primary_supervisor")
-
     print("Building supervisor set...")
 
+    # One groupby pass for the counts; the merged columns are aligned to
+    # its index so every supervisor keeps a row even when all values are NaN
+    sizes = df.groupby("primary_supervisor").size()
+
     supervisor_set = pd.DataFrame({
-        "username": groups.size().index,
-        "n_projects": groups.size().values,
-        "merged_keywords": groups["keywords"].apply(merge_unique).values,
-        "merged_types": groups["type"].apply(merge_unique).values,
+        "username": sizes.index,
+        "n_projects": sizes.values,
+        "merged_keywords": merge_unique(df, "keywords")
+            .reindex(sizes.index, fill_value="").values,
+        "merged_types": merge_unique(df, "type")
+            .reindex(sizes.index, fill_value="").values,
     })
 
     print("Saving supervisor_set.csv...")